@@ -1,7 +1,13 @@
 # Import required libraries
+from collections.abc import Iterable
 import http.server, os
+import urllib.parse
 import socketserver
+import threading
 import datetime
+import time as clock
+import socket
+import struct
 import random
 import string
 import json
@@ -15,6 +21,18 @@ TOKEN_LENGTH = 16
 ENCODING = "utf-8"
 AMNESIA = True
 PORT = 8080 if len(sys.argv) == 1 else int(sys.argv[1])
+ADMIN_TOKEN = os.environ.get("STORM_ADMIN") # Generated on startup if unset
+PROFILE_PATH = "/profile"
+PROFILE_MAX_SECONDS = 300
+PROFILE_INTERVAL = 0.005 # Seconds between samples for the sampling profiler
+PROFILE_TOP = 25
+# Seconds a client gets to send the request line and headers, send the body
+# and receive the response, and the largest accepted body in bytes
+HEADER_TIMEOUT = float(os.environ.get("STORM_HEADER_TIMEOUT", 10))
+READ_TIMEOUT = float(os.environ.get("STORM_READ_TIMEOUT", 10))
+WRITE_TIMEOUT = float(os.environ.get("STORM_WRITE_TIMEOUT", 10))
+MAX_BODY = int(os.environ.get("STORM_MAX_BODY", 64 * 1024))
+CHUNK_SIZE = 16 * 1024 # Bytes buffered before a streamed chunk is sent
 
 # Status strings
 NOT_REGISTERED = ("Client not registered.", 403)
@@ -30,12 +48,22 @@ REJECT_NICK = (f"Nickname is inappropriate, over {NICK_LENGTH} characters long o
 MESSAGE_CREATED = ("Message created.", 201)
 
 INVALID = ("Invalid request.", 400)
+LENGTH_REQUIRED = ("Content-Length required.", 411)
+TOO_LARGE = (f"Request body is over {MAX_BODY} bytes.", 413)
+FORBIDDEN = ("Not authorised.", 403)
+
+PROFILE_STARTED = lambda seconds : (f"Profiling for {seconds} seconds.", 201)
+PROFILE_STOPPED = ("Profiling stopped.", 200)
+PROFILE_RUNNING = ("Profiling is already running.", 409)
+PROFILE_EMPTY = ("No profile available.", 404)
 SUCCESS = ("Success.", 200)
 ERROR = ("Internal error.", 500)
 
 # Global variables
 users: list["StormUser"] = []
 messages: list["StormMessage"] = []
+users_lock = threading.Lock() # Held while registering or renaming users
+NO_DATA = object() # Returned by StormHandler.read once it has dealt with a bad body
 
 def get(l: list[object], attr: str, value: object) -> object | None:
     "Finds the object in `l` where `l[x].attr` is equal to `value`."
@@ -66,6 +94,189 @@ def time() -> str:
 
     return datetime.datetime.now().strftime("%H:%M")
 
+class StormProfiler:
+    """Switches cProfile, a sampling profiler and tracemalloc on and off at
+    runtime. Nothing is imported or hooked until profiling is started, so it
+    costs nothing while off."""
+
+    def __init__(self) -> None:
+        self.mode, self.memory = None, False
+        self.deadline = None
+        self.results = None
+        self._profile, self._samples = None, None
+        self.skipped = 0
+        self._lock = threading.RLock() # Held while a request is being profiled
+        self._control = threading.Lock() # Held while starting or stopping
+        self._stop, self._sampler = threading.Event(), None
+
+    @property
+    def running(self) -> bool:
+        return self.deadline != None
+
+    def start(self, mode: str | None, memory: bool, seconds: float) -> bool:
+        """Starts profiling for `seconds`. `mode` is `"cprofile"`, `"sample"`
+        or `None`, `memory` enables tracemalloc. Returns `False` if profiling
+        is already running."""
+
+        with self._control:
+            if self.running:
+                return False
+
+            self.mode, self.memory = mode, memory
+            self.deadline = clock.monotonic() + seconds
+            self.results = None
+
+            if memory:
+                import tracemalloc
+                tracemalloc.start()
+            if mode == "cprofile":
+                import cProfile
+                self._profile, self.skipped = cProfile.Profile(), 0
+            elif mode == "sample":
+                # Each run gets its own samples and stop event, so a sampler left
+                # over from a previous run can't touch this one
+                self._samples, self._stop = {"stacks": 0, "functions": {}}, threading.Event()
+                self._sampler = threading.Thread(target=self._sample, daemon=True,
+                                                 args=(self._samples, self._stop, self.deadline))
+                self._sampler.start()
+            return True
+
+    def run(self, func: object) -> object:
+        """Runs `func`, under cProfile if it is running. Only one request is
+        profiled at a time, since newer Pythons allow only one active profiler
+        per interpreter; requests that overlap it run unprofiled and are
+        counted in `skipped`."""
+
+        profile = self._profile
+        if profile == None:
+            return func()
+        if not self._lock.acquire(blocking=False):
+            self.skipped += 1
+            return func()
+        try:
+            return profile.runcall(func)
+        finally:
+            self._lock.release()
+
+    def _sample(self, samples: dict, stop: threading.Event, deadline: float) -> None:
+        """Periodically records the stack of every thread serving a request
+        into `samples` until `stop` is set or `deadline` passes. Each function
+        on a stack counts towards its cumulative hits, the innermost one
+        towards its own."""
+
+        me, functions = threading.get_ident(), samples["functions"]
+        while not stop.wait(PROFILE_INTERVAL) and clock.monotonic() < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame != None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_filename}:{code.co_firstlineno}({code.co_name})")
+                    frame = frame.f_back
+                # The accept loop is idle, not request work
+                if any(k.endswith("(serve_forever)") for k in stack):
+                    continue
+
+                samples["stacks"] += 1
+                functions.setdefault(stack[0], [0, 0])[0] += 1
+                for key in set(stack):
+                    functions.setdefault(key, [0, 0])[1] += 1
+
+    def expire(self) -> None:
+        "Stops profiling if its window has passed. Cheap when not running."
+
+        if self.deadline != None and clock.monotonic() >= self.deadline:
+            self.stop()
+
+    def stop(self) -> None:
+        "Stops profiling and keeps the results for downloading."
+
+        with self._control:
+            if not self.running:
+                return
+            self.deadline = None
+            self._stop.set()
+            results = {"mode": self.mode, "profile": None, "memory": None}
+
+            if self._profile != None:
+                # Turned into stats later, once any request still using it is done
+                results["profile"], self._profile = self._profile, None
+                results["skipped"] = self.skipped
+            elif self._samples != None:
+                self._sampler.join() # Let it finish its last pass
+                results["profile"], self._samples = self._samples, None
+
+            if self.memory:
+                import tracemalloc
+                results["memory"] = tracemalloc.take_snapshot()
+                tracemalloc.stop()
+
+            self.results = results
+
+    def table(self, top: int = PROFILE_TOP) -> dict:
+        "Returns the top `top` entries of the last results as a dictionary."
+
+        profile, memory = self.results["profile"], self.results["memory"]
+        data = {"mode": self.results["mode"], "profile": None, "memory": None}
+
+        if self.results["mode"] == "cprofile":
+            data["skipped"] = self.results["skipped"]
+            rows = sorted(self._stats().stats.items(), key=lambda i : i[1][3], reverse=True)
+            data["profile"] = [{
+                "function": f"{f}:{l}({n})",
+                "calls": nc,
+                "tottime": tt,
+                "cumtime": ct
+            } for (f, l, n), (_, nc, tt, ct, _) in rows[:top]]
+        elif self.results["mode"] == "sample":
+            total = profile["stacks"] or 1
+            rows = sorted(profile["functions"].items(), key=lambda i : i[1][1], reverse=True)
+            data["profile"] = [{
+                "function": f,
+                "self": own,
+                "cumulative": cumulative,
+                "fraction": cumulative / total
+            } for f, (own, cumulative) in rows[:top]]
+
+        if memory != None:
+            data["memory"] = [{
+                "location": str(s.traceback),
+                "size": s.size,
+                "count": s.count
+            } for s in memory.statistics("lineno")[:top]]
+        return data
+
+    def dump(self) -> bytes | None:
+        "Returns the last cProfile results in `pstats` dump format."
+
+        if self.results == None or self.results["mode"] != "cprofile":
+            return None
+        import marshal
+        return marshal.dumps(self._stats().stats)
+
+    def _stats(self) -> object:
+        "Returns the last cProfile results as a `pstats.Stats`."
+
+        import pstats
+        with self._lock: # Waits for a request still being profiled
+            if not isinstance(self.results["profile"], pstats.Stats):
+                self.results["profile"] = pstats.Stats(self.results["profile"])
+        return self.results["profile"]
+
+profiler = StormProfiler()
+
+def profiled(method: object) -> object:
+    """Decorates a `StormHandler.do_*` method so that it runs under
+    `profiler`. Any request body is received beforehand, so time spent waiting
+    on the client is never profiled."""
+
+    def wrapper(self: "StormHandler") -> None:
+        if self.headers.get("Content-Length") != None and self.receive() is NO_DATA:
+            return
+        return profiler.run(lambda : method(self))
+    return wrapper
+
 class StormObject:
     "Represents a generic storm JSONifiable object (e.g. users, messages)."
 
@@ -153,6 +364,10 @@ class StormMessage(StormObject):
 class StormHandler(http.server.BaseHTTPRequestHandler):
     "The storm HTTP request handler."
 
+    # For chunked responses, connections are still closed after each request
+    protocol_version = "HTTP/1.1"
+    timeout = READ_TIMEOUT
+
     def __init__(self, request: object,
                 client_address: tuple[str, int],
                 server: socketserver.BaseServer) -> None:
@@ -170,6 +385,36 @@ class StormHandler(http.server.BaseHTTPRequestHandler):
 
         return self.headers.get("Token", "")
 
+    @property
+    def route(self) -> str:
+        "The requested path, without the query."
+
+        return urllib.parse.urlsplit(self.path).path
+
+    @property
+    def admin(self) -> bool:
+        "Whether the client authenticated with the admin token."
+
+        return ADMIN_TOKEN != None and self.token == ADMIN_TOKEN
+
+    def handle_one_request(self) -> None:
+        # The server shuts the connection down if the headers take too long
+        self.server.watch(self, HEADER_TIMEOUT)
+        self._body = None
+        try:
+            super().handle_one_request()
+        except OSError: # Timed out, shut down or went away
+            self.close_connection = True
+        finally:
+            self.server.unwatch(self)
+
+    def parse_request(self) -> bool:
+        # This reads the headers, after which the body and response have
+        # their own deadlines
+        ok = super().parse_request()
+        self.server.unwatch(self)
+        return ok
+
     def respond(self, data: bytes | str | dict | list, code: int = 200,
                 **headers) -> None:
         "A clean function that runs the boilerplate response code."
@@ -179,41 +424,203 @@ class StormHandler(http.server.BaseHTTPRequestHandler):
             "reason": data
         } if type(data) in [str, bytes] else data)
 
-        self.send_response(code)
-        self.send_header("Content-Type", "application/json")
-        for h, v in headers.items():
-            self.send_header(h, v)
-        self.end_headers()
-        self.wfile.write(bytes(data, ENCODING))
-
-    def read(self, is_json: bool = False) -> str | dict | list:
-        "Gets and returns the POST data."
+        self.send(bytes(data, ENCODING), code, "application/json", **headers)
+
+    def send(self, data: bytes, code: int = 200, content_type: str = "application/json",
+             **headers) -> None:
+        """Writes a response, giving up if the client takes longer than
+        `WRITE_TIMEOUT` to receive it."""
+
+        self.connection.settimeout(WRITE_TIMEOUT) # Bounds the whole write
+        try:
+            self.send_response(code)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.send_header("Connection", "close")
+            for h, v in headers.items():
+                self.send_header(h, v)
+            self.end_headers()
+            self.wfile.write(data)
+        except TimeoutError:
+            self.reset()
+            raise
+
+    def stream(self, items: Iterable[dict], code: int = 200) -> None:
+        """Writes `items` as a JSON list using chunked transfer encoding,
+        encoding one item at a time so memory use doesn't grow with the
+        length of `items`. HTTP/1.0 clients can't take chunks, so they get
+        the same body unframed, ended by closing the connection. The whole
+        write must finish within `WRITE_TIMEOUT`."""
+
+        chunked = self.request_version != "HTTP/1.0"
+
+        def chunk(data: bytearray) -> None:
+            if chunked:
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            else:
+                self.wfile.write(data)
+            data.clear()
+
+        # Each write gets the socket timeout, the server enforces the total
+        self.connection.settimeout(WRITE_TIMEOUT)
+        self.server.watch(self, WRITE_TIMEOUT)
+        try:
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            if chunked:
+                self.send_header("Transfer-Encoding", "chunked")
+            self.send_header("Connection", "close")
+            self.end_headers()
+
+            data, separator = bytearray(b"["), b""
+            for item in items:
+                data += separator + bytes(json.dumps(item), ENCODING)
+                separator = b", "
+                if len(data) >= CHUNK_SIZE:
+                    chunk(data)
+            data += b"]"
+            chunk(data)
+            if chunked:
+                self.wfile.write(b"0\r\n\r\n")
+        except OSError:
+            self.reset()
+            raise
+        finally:
+            self.server.unwatch(self)
+
+    def reset(self) -> None:
+        "Makes closing the connection reset it, dropping any unsent response."
+
+        try:
+            self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER,
+                                       struct.pack("ii", 1, 0))
+        except OSError:
+            pass # Already gone
+
+    def receive(self) -> bytes | object:
+        """Receives the request body, once. Responds with an error if needed
+        and returns `NO_DATA` if the body is missing, too large or
+        incomplete."""
+
+        if self._body == None:
+            self._body = self._receive()
+        return self._body
+
+    def _receive(self) -> bytes | object:
+        try:
+            length = int(self.headers["Content-Length"])
+        except (TypeError, ValueError):
+            self.respond(*LENGTH_REQUIRED)
+            return NO_DATA
+        if length > MAX_BODY:
+            self.close_connection = True
+            self.respond(*TOO_LARGE)
+            return NO_DATA
+
+        # The server shuts the connection down if the body takes too long
+        self.server.watch(self, READ_TIMEOUT)
+        try:
+            data = self.rfile.read(max(length, 0))
+        finally:
+            self.server.unwatch(self)
+        if len(data) < length:
+            self.close_connection = True
+            return NO_DATA
+        return data
 
-        data = self.rfile.read(int(self.headers["Content-Length"])).decode(ENCODING)
-        return json.loads(data) if is_json else data
+    def read(self, is_json: bool = False) -> object:
+        """Gets and returns the POST data. Responds with an error if needed
+        and returns `NO_DATA` if the body is missing, too large, incomplete or
+        invalid."""
+
+        data = self.receive()
+        if data is NO_DATA:
+            return NO_DATA
+        try:
+            data = data.decode(ENCODING)
+            return json.loads(data) if is_json else data
+        except (ValueError, RecursionError): # RecursionError for deeply nested JSON
+            self.respond(*INVALID)
+            return NO_DATA
+
+    def profile(self) -> None:
+        "Handles the admin profiling control at `PROFILE_PATH`."
+
+        if not self.admin:
+            return self.respond(*FORBIDDEN)
+
+        # Download the results
+        if self.command == "GET":
+            if profiler.running:
+                return self.respond(*PROFILE_RUNNING)
+            if profiler.results == None:
+                return self.respond(*PROFILE_EMPTY)
+            query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+            if query.get("format") == ["pstats"]:
+                data = profiler.dump()
+                if data == None:
+                    return self.respond(*PROFILE_EMPTY)
+                return self.send(data, 200, "application/octet-stream", **{
+                    "Content-Disposition": "attachment; filename=\"storm.pstats\""
+                })
+            try:
+                top = int(query.get("top", [PROFILE_TOP])[0])
+            except ValueError:
+                return self.respond(*INVALID)
+            return self.respond(profiler.table(top))
+
+        # Stop early
+        if self.command == "DELETE":
+            profiler.stop()
+            return self.respond(*PROFILE_STOPPED)
+
+        # Start
+        data = self.read(True)
+        if data is NO_DATA:
+            return
+        if not isinstance(data, dict):
+            return self.respond(*INVALID)
+        mode, memory = data.get("mode"), data.get("memory", False) == True
+        seconds = data.get("seconds", 10)
+        if mode not in ["cprofile", "sample", None] or (mode == None and not memory) \
+                or type(seconds) not in [int, float] or not 0 < seconds <= PROFILE_MAX_SECONDS:
+            return self.respond(*INVALID)
+        if not profiler.start(mode, memory, seconds):
+            return self.respond(*PROFILE_RUNNING)
+        return self.respond(*PROFILE_STARTED(seconds))
 
+    @profiled
     def do_GET(self) -> None:
+        if self.route == PROFILE_PATH:
+            return self.profile()
+
         # Check if the user is registered
         user: StormUser = get(users, "token", self.token)
         if user == None:
             return self.respond(*NOT_REGISTERED)
         
         # Give the user the messages
-        self.respond([m.to_json(True) for m in messages])
+        self.stream(m.to_json(True) for m in messages)
 
+    @profiled
     def do_POST(self) -> None:
+        if self.route == PROFILE_PATH:
+            return self.profile()
+
         # Register the user if they're not already
         user: StormUser = get(users, "token", self.token)
         if user == None:
-            users.append(
-                StormUser(self.address,
+            with users_lock:
+                user = StormUser(self.address,
                     once([u.nickname for u in users], generate)
                 )
-            )
-            return self.respond(*REGISTERED(users[-1].token))
+                users.append(user)
+            return self.respond(*REGISTERED(user.token))
         
         # Add their message, given that it's valid
         data = self.read(True)
+        if data is NO_DATA:
+            return
         if not isinstance(data, dict):
             return self.respond(*INVALID)
 
@@ -227,6 +634,7 @@ class StormHandler(http.server.BaseHTTPRequestHandler):
             )
             return self.respond(*MESSAGE_CREATED)
     
+    @profiled
     def do_PATCH(self) -> None:
         # Check if the user is registered
         user: StormUser = get(users, "token", self.token)
@@ -235,26 +643,71 @@ class StormHandler(http.server.BaseHTTPRequestHandler):
         
         # Get the patch data
         data = self.read(True)
+        if data is NO_DATA:
+            return
         if not isinstance(data, dict):
             return self.respond(*INVALID)
         
         # Get the new nickname
         nickname = data.get("nickname")
-        if nickname == None or len(nickname) > NICK_LENGTH or nickname in [u.nickname for u in users]:
-            return self.respond(*REJECT_NICK)
-        else:
+        with users_lock:
+            if nickname == None or len(nickname) > NICK_LENGTH or nickname in [u.nickname for u in users]:
+                return self.respond(*REJECT_NICK)
             user.nickname = nickname
-            return self.respond(*CHANGE_NICK)
+        return self.respond(*CHANGE_NICK)
+
+    @profiled
+    def do_DELETE(self) -> None:
+        if self.route == PROFILE_PATH:
+            return self.profile()
+        return self.respond(*INVALID)
+
+class StormServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """The storm TCP server. Serves every connection on its own thread and
+    shuts down connections that miss their deadlines, so slow clients can't
+    hold up anyone else."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128 # Slow clients shouldn't fill the accept queue
+
+    def __init__(self, *args, **kwargs) -> None:
+        self.deadlines: dict[StormHandler, float] = {}
+        super().__init__(*args, **kwargs)
+
+    def watch(self, handler: StormHandler, seconds: float) -> None:
+        "Shuts `handler`'s connection down if it is still watched after `seconds`."
+
+        self.deadlines[handler] = clock.monotonic() + seconds
+
+    def unwatch(self, handler: StormHandler) -> None:
+        "Stops watching `handler`."
+
+        self.deadlines.pop(handler, None)
+
+    def service_actions(self) -> None:
+        # Runs between polls on the main thread
+        now = clock.monotonic()
+        for handler, deadline in list(self.deadlines.items()):
+            if now >= deadline:
+                self.unwatch(handler)
+                try:
+                    handler.connection.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass # Already gone
+        profiler.expire()
 
 # Run the HTTP server
 if __name__ == "__main__":
+    ADMIN_TOKEN = ADMIN_TOKEN or generate(TOKEN_LENGTH)
     try:
         # Attempt to load the messages and users
         if not AMNESIA and os.path.isfile(USERS_FILE) and os.path.isfile(MESSAGES_FILE):
             users = [StormUser.from_json(u) for u in json.load(open(USERS_FILE, "r"))]
             messages = [StormMessage.from_json(m) for m in json.load(open(MESSAGES_FILE, "r"))]
-        with socketserver.TCPServer(("", PORT), StormHandler) as httpd:
+        with StormServer(("", PORT), StormHandler) as httpd:
             print(f"Serving at port '{PORT}'.")
+            print(f"Admin token is '{ADMIN_TOKEN}'.")
             httpd.serve_forever()
     except KeyboardInterrupt: # Allow graceful exit
         # Write the messages and users to files
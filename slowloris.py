@@ -0,0 +1,138 @@
+# Import required libraries
+import http.client
+import subprocess
+import statistics
+import threading
+import socket
+import json
+import time
+import sys
+import os
+
+# Configuration
+PORT = 8089 if len(sys.argv) == 1 else int(sys.argv[1])
+SLOW_CLIENTS = 20
+REQUESTS = 20
+TIMEOUT = 2 # Server timeouts used for the run, in seconds
+MEDIAN_RATIO = 2 # How much slower the median may get under attack
+P90_RATIO = 5 # How much slower the 90th percentile may get under attack
+SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py")
+
+def connect() -> socket.socket:
+    "Opens a raw connection to the server."
+
+    return socket.create_connection(("127.0.0.1", PORT))
+
+def request(method: str, token: str = "", body: dict | None = None) -> tuple[float, dict]:
+    "Sends a normal request and returns the seconds it took and the JSON reply."
+
+    start = time.perf_counter()
+    conn = http.client.HTTPConnection("127.0.0.1", PORT, timeout=30)
+    conn.request(method, "/", json.dumps(body) if body != None else None, {"Token": token})
+    data = json.loads(conn.getresponse().read())
+    conn.close()
+    return time.perf_counter() - start, data
+
+def latency(token: str) -> list[float]:
+    "Times `REQUESTS` PATCH and POST requests."
+
+    times = []
+    for _ in range(REQUESTS):
+        times.append(request("PATCH", token, {"nickname": "x"})[0])
+        times.append(request("POST", "")[0])
+    return times
+
+def attack(token: str) -> list[socket.socket]:
+    """Opens slow clients: some trickle their headers, some claim a large body
+    and stall, and some request responses and never read them."""
+
+    socks = []
+    for n in range(SLOW_CLIENTS):
+        s = connect()
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024)
+        if n % 3 == 0: # Headers that never finish
+            s.sendall(b"GET / HTTP/1.1\r\nX-a: ")
+        elif n % 3 == 1: # A body that never arrives
+            s.sendall(b"POST / HTTP/1.1\r\nToken: x\r\nContent-Length: 60000\r\n\r\n{")
+        else: # Responses that are never read
+            s.sendall(f"GET / HTTP/1.1\r\nToken: {token}\r\n\r\n".encode())
+        socks.append(s)
+    return socks
+
+def trickle() -> list[float]:
+    """Opens a client that keeps sending header bytes faster than the read
+    timeout, so only the header deadline can drop it. Returns a list that
+    gets the seconds it took to be dropped."""
+
+    dropped, s = [], connect()
+    s.sendall(b"GET / HTTP/1.1\r\n")
+
+    def send():
+        start = time.perf_counter()
+        try:
+            while True:
+                time.sleep(TIMEOUT / 4)
+                s.sendall(b"X-a: b\r\n")
+        except OSError:
+            dropped.append(time.perf_counter() - start)
+
+    threading.Thread(target=send, daemon=True).start()
+    return dropped
+
+def closed(s: socket.socket) -> bool:
+    "Whether the server has closed `s`."
+
+    s.settimeout(0.1)
+    try:
+        while True:
+            data = s.recv(65536)
+            if not data:
+                return True
+    except socket.timeout:
+        return False
+    except OSError:
+        return True
+
+def stats(times: list[float]) -> tuple[float, float, float]:
+    "Returns the median, 90th percentile and maximum of `times`."
+
+    return statistics.median(times), statistics.quantiles(times, n=10)[-1], max(times)
+
+def report(name: str, times: list[float]) -> None:
+    median, p90, worst = stats(times)
+    print(f"{name}: median {median * 1000:.1f}ms, p90 {p90 * 1000:.1f}ms, max {worst * 1000:.1f}ms")
+
+# Run the harness
+if __name__ == "__main__":
+    env = {**os.environ, "STORM_HEADER_TIMEOUT": str(TIMEOUT),
+           "STORM_READ_TIMEOUT": str(TIMEOUT), "STORM_WRITE_TIMEOUT": str(TIMEOUT)}
+    server = subprocess.Popen((sys.executable, SERVER, str(PORT)), env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        time.sleep(1)
+        token = request("POST")[1]["token"]
+        for _ in range(300): # Big enough that unread responses fill the socket buffers
+            request("POST", token, {"content": "x" * 50000})
+
+        baseline = latency(token)
+        trickled = trickle()
+        socks = attack(token)
+        loaded = latency(token)
+        time.sleep(TIMEOUT * 2)
+        dropped = sum(closed(s) for s in socks)
+
+        report("Baseline", baseline)
+        report("Under attack", loaded)
+        print(f"Slow clients dropped: {dropped}/{len(socks)}")
+        print("Header trickler dropped after " + (f"{trickled[0]:.1f}s" if trickled else "never"))
+        # Latency must stay close to the baseline, the cap catches stalls
+        (base_median, base_p90, _), (median, p90, worst) = stats(baseline), stats(loaded)
+        ok = median <= base_median * MEDIAN_RATIO and p90 <= base_p90 * P90_RATIO \
+            and worst < TIMEOUT / 2 and dropped == len(socks)
+        # The header deadline is checked every half second, and the trickler
+        # only notices on its next send
+        ok = ok and len(trickled) == 1 and trickled[0] <= TIMEOUT + 0.5 + TIMEOUT / 4 + 0.5
+        print("PASS" if ok else "FAIL")
+        sys.exit(0 if ok else 1)
+    finally:
+        server.terminate()
@@ -0,0 +1,41 @@
+# Import required libraries
+import subprocess
+import statistics
+import tempfile
+import json
+import time
+import sys
+import os
+
+# Configuration
+RUNS = 5 if len(sys.argv) == 1 else int(sys.argv[1])
+STARTUP_ENV = "STORM_STARTUP"
+CLIENT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "storm.py")
+CONFIG = "config.json"
+
+def measure(cwd: str) -> float:
+    """Launches the client once in `cwd` and returns the seconds taken until
+    its first interactive window (the configuration window) is up."""
+
+    start = time.time()
+    output = subprocess.run(
+        (sys.executable, CLIENT), env={**os.environ, STARTUP_ENV: "1"},
+        stdout=subprocess.PIPE, text=True, cwd=cwd
+    ).stdout
+    for line in output.splitlines():
+        if line.startswith(f"{STARTUP_ENV}="):
+            return float(line.split("=", 1)[1]) - start
+    raise RuntimeError("Client exited without opening a window.")
+
+# Run the measurement
+if __name__ == "__main__":
+    # Run from a directory with a cached scale so the first-run scaling
+    # prompt never blocks the measurement
+    with tempfile.TemporaryDirectory() as cwd:
+        with open(os.path.join(cwd, CONFIG), "w") as f:
+            json.dump({"scale": [1, 1]}, f)
+        times = [measure(cwd) for _ in range(RUNS)]
+    print(f"Runs: {RUNS}")
+    print(f"Min: {min(times) * 1000:.1f}ms")
+    print(f"Median: {statistics.median(times) * 1000:.1f}ms")
+    print(f"Max: {max(times) * 1000:.1f}ms")
@@ -2,9 +2,7 @@
 import tkinter.messagebox as msg
 import tkinter.font as tkfont
 import tkinter as tk
-import subprocess
 import threading
-import requests
 import atexit
 import time
 import json
@@ -30,7 +28,8 @@ def window() -> tk.Tk:
     "Creates a `tk.Tk` window but applies necessary modifications first."
 
     root = tk.Tk()
-    root.option_add("*Dialog.msg.font", f"{FONT[0]} {FONT[1]}")
+    family, size, _ = font()
+    root.option_add("*Dialog.msg.font", f"{family} {size}")
     root.config(cursor="dot green red")
     return root
 
@@ -45,27 +44,74 @@ def screen_geometry() -> tuple[int, int]:
     root.destroy()
     return geometry
 
+def display_scale() -> tuple[float, float]:
+    """Returns the display scale, detecting it on the first call and caching
+    it both in memory and in the `CONFIG` file for subsequent runs."""
+
+    global SCALE
+    if SCALE != None:
+        return SCALE
+    
+    # Use the stored scale if there is one
+    if os.path.isfile(CONFIG):
+        try:
+            cached = json.loads(read(CONFIG))["scale"]
+        except (ValueError, KeyError, TypeError):
+            cached = None # Unreadable config, detect again
+        # Only trust an (x, y) pair of positive numbers, detect again otherwise
+        if isinstance(cached, list) and len(cached) == 2 and all(
+                type(n) in [int, float] and n > 0 for n in cached):
+            SCALE = tuple(cached)
+            return SCALE
+
+    width, height = screen_geometry()
+    SCALE = (
+        width / 1920,
+        height / 1080
+    ) if Popup.yes_or_no(
+        """Your display is smaller/larger than a standard monitor.
+    
+Dynamic scaling will adjust the graphical interface to size correctly.
+However, it may cause elements to be positioned incorrectly.
+    
+Enable it?""",
+        False
+    ) else (1, 1)
+    try:
+        write(json.dumps({"scale": list(SCALE)}), CONFIG)
+    except OSError:
+        pass # Can't cache it here, ask again next time
+    return SCALE
+
 def scale(n: int | str | tuple, p: str | None = "x") -> int | str | dict:
     "Scales `n` (a set of dimensions, scale, or other) based on the screen dimensions."
 
+    sx, sy = display_scale()
     t = type(n)
     if t == int:
-        return int(round(n * (SCALE[0] if p == "x" else SCALE[1])))
+        return int(round(n * (sx if p == "x" else sy)))
     elif t == str:
         x, y, = n.split("x")
-        return "x".join([str(int(round(int(x) * SCALE[0]))),
-                        str(int(round(int(y) * SCALE[1])))])
+        return "x".join([str(int(round(int(x) * sx))),
+                        str(int(round(int(y) * sy)))])
     else:
         # For kwargs!! Cus I'm nice neat like that
         return {
-            "x": int(round(n[0] * SCALE[0])),
-            "y": int(round(n[1] * SCALE[1]))
+            "x": int(round(n[0] * sx)),
+            "y": int(round(n[1] * sy))
         }
     
+def font() -> tuple[str, int, str]:
+    "Returns the font used by all widgets, sized for the display scale."
+
+    return ("Arial", scale(12, "x"), "normal")
+    
 def run(command: str | tuple) -> int | str:
     """Runs `command`. Returns the code that the program provides, or the output
     if retrievable."""
 
+    import subprocess # Rarely used, so don't pay for it at startup
+
     output = None
     try:
         output = subprocess.run(
@@ -153,7 +199,8 @@ class StormClient:
 
     def request(self, data: dict | list = None, method: str = None) -> list | dict:
         "Forms a `request.Request` object with the proper headers."
-       
+
+        import requests # Deferred, it's slow to import
         return requests.request(
             method, self.address, data=json.dumps(data) if data != None else data,
                 headers = {
@@ -215,6 +262,7 @@ class StormClient:
             try:
                 r = self.post()
             except Exception as e:
+                import requests
                 if type(e) == requests.HTTPError: 
                     return True
                 else:
@@ -311,9 +359,13 @@ def create_client() -> StormClient:
     root.geometry(scale("170x120"))
     root.configure(background="#F0F8FF")
     root.title("Configuration")
+    # Report time to first interactive window (see startup.py)
+    if os.environ.get(STARTUP_ENV):
+        root.after_idle(lambda : (print(f"{STARTUP_ENV}={time.time()}", flush=True),
+                                  os._exit(0)))
 
     # Ip and port inputs
-    ip_input, port_input = tk.Entry(root, width=10, font=FONT), tk.Entry(root, width=5, font=FONT)
+    ip_input, port_input = tk.Entry(root, width=10, font=font()), tk.Entry(root, width=5, font=font())
     ip_input.place(**scale((10, 35)))
     port_input.place(**scale((110, 35)))
     # Insert defaults
@@ -321,11 +373,11 @@ def create_client() -> StormClient:
     port_input.insert(0, "8080")
 
     # Ip and port labels
-    tk.Label(root, text="IP:", bg="#F0F8FF", font=FONT).place(**scale((10, 10)))
-    tk.Label(root, text="Port:", bg="#F0F8FF", font=FONT).place(**scale((110, 10)))
+    tk.Label(root, text="IP:", bg="#F0F8FF", font=font()).place(**scale((10, 10)))
+    tk.Label(root, text="Port:", bg="#F0F8FF", font=font()).place(**scale((110, 10)))
 
     # Submit button
-    connect_button = tk.Button(root, text="Connect", font=FONT, command=stop_gui)
+    connect_button = tk.Button(root, text="Connect", font=font(), command=stop_gui)
     connect_button.place(**scale((40, 70))) 
 
     root.mainloop()
@@ -337,22 +389,11 @@ def create_client() -> StormClient:
     return StormClient(ip, port)
 
 # Configuration
-WIDTH, HEIGHT = screen_geometry()
-SCALE = (
-    WIDTH / 1920,
-    HEIGHT / 1080
-) if Popup.yes_or_no(
-    """Your display is smaller/larger than a standard monitor.
-    
-Dynamic scaling will adjust the graphical interface to size correctly.
-However, it may cause elements to be positioned incorrectly.
-    
-Enable it?""",
-    False
-) else (1, 1)
-FONT = ("Arial", scale(12, "x"), "normal")
+SCALE = None # Detected lazily by display_scale()
 REFRESH = 5
 TOKEN = "token"
+CONFIG = "config.json"
+STARTUP_ENV = "STORM_STARTUP"
 MESSAGES = "messages.json"
 TEXT_BG = "#181d26"
 TEXT_FG = "#ffffff"
@@ -377,7 +418,9 @@ if __name__ == "__main__":
     # Error handler
     @client.on_error
     def on_error(e: Exception):
-        if type(e) == requests.ConnectionError:
+        import requests
+        # A history cut off mid-stream is a connection problem too
+        if isinstance(e, (requests.ConnectionError, requests.exceptions.ChunkedEncodingError)):
             client.kill()
             Popup.error("There was a problem connecting to the server.", True)
         elif type(e) == requests.HTTPError:
@@ -416,7 +459,7 @@ if __name__ == "__main__":
     # Chat list
     chat = tk.Text(chat_win, width=scale(500), height=scale(500, "y"),
                     fg=TEXT_FG, bg=TEXT_BG, wrap="word", state="disabled",
-                    font=FONT, padx=scale(3), pady=scale(3))   
+                    font=font(), padx=scale(3), pady=scale(3))   
     chat.pack()
 
     # Fill chat automatically
@@ -445,13 +488,13 @@ if __name__ == "__main__":
     add() # Start immediately
 
     # Download messages
-    download = tk.Button(chat_win, text="↓", font=FONT,
+    download = tk.Button(chat_win, text="↓", font=font(),
         command=lambda : (write(json.dumps(client.messages, indent=4), MESSAGES),
                             Popup.info("Download", f"Saved message log to '{MESSAGES}'.")))
     download.place(**scale((450, 450)))
 
     # Message input
-    message = tk.Entry(message_win, width=53, bg=TEXT_BG, fg=TEXT_FG, font=FONT,
+    message = tk.Entry(message_win, width=53, bg=TEXT_BG, fg=TEXT_FG, font=font(),
                     insertbackground="white")
     message.place(**scale((10, 10)))
     message.bind("<Return>", lambda *args : send()) # When enter is pressed